@@ -3,28 +3,62 @@ DocuChat AI - Flask Backend
 This backend handles document uploads, vector embeddings, and RAG-based chat interactions.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import mmap
+import shutil
+import subprocess
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
+from dataclasses import dataclass, field
 import chromadb
 from chromadb.config import Settings
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_community.document_loaders import UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from semantic_text_splitter import TextSplitter
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.llms import Ollama
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+import re
 import uuid
-import json
+import orjson
+import queue
+import atexit
+import threading
+import time
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson, used by every jsonify() call."""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand the encoded bytes straight to the response without a str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+class UploadRequest(Request):
+    """Request class that keeps at most 1MB of non-file form data in memory."""
+    max_form_memory_size = 1 << 20
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.request_class = UploadRequest
 
 # Configure CORS to allow requests from Next.js frontend
 CORS(app, resources={
@@ -42,10 +76,17 @@ logger = logging.getLogger(__name__)
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 CHROMA_DB_DIR = 'chroma_db'
+DOCUMENTS_COLLECTION = 'docuchat'  # Chroma collection holding the uploaded documents
 CHAT_HISTORY_DIR = 'chat_history'
 CHAT_HISTORY_FILE = os.path.join(CHAT_HISTORY_DIR, 'history.json')
 SESSION_FILE = os.path.join(CHAT_HISTORY_DIR, 'session.json')
+HISTORY_LOG_FILE = os.path.join(CHAT_HISTORY_DIR, 'history.log')
+SESSION_WAL_FILE = os.path.join(CHAT_HISTORY_DIR, 'session_wal.jsonl')
+SESSION_WAL_COMPACT_BYTES = 1 << 20  # Rewrite the snapshot once the WAL exceeds 1MB
+ROTATED_LOG_SUFFIX = '.old'  # Log moved aside while the snapshot covering it is written
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
+IO_BUFFER_SIZE = 1 << 20  # 1MB buffer for session/history file I/O
+PERSIST_DEBOUNCE_SECONDS = 0.2  # Window for coalescing background writes
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -55,23 +96,131 @@ os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 
-# Global variables for vector store and LLM
-vector_store = None
-qa_chain = None
-document_metadata = {}
-all_documents = []  # Store all document chunks for multi-document support
-active_session_id = None  # Track which session is currently active
+# Number of chunks embedded and inserted into Chroma per add() call
+CHROMA_BATCH_SIZE = 512
+# Concurrent embedding requests sent to Ollama
+EMBEDDING_WORKERS = 8
+# /clear deletes uploads with batched `rm` calls above this many files (POSIX only)
+RM_BATCH_THRESHOLD = 100
+# Bytes of file names per `rm` call, well below the kernel's ARG_MAX
+RM_ARG_BYTES = 1 << 17
+# Threads used for large deletes where `rm` is unavailable (unlink releases the GIL)
+UNLINK_WORKERS = 16
+
+# Sentence boundary used when shortening citations
+_SENT_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+@dataclass
+class AppState:
+    """
+    Mutable application state shared by the request handlers.
+    Kept in app.extensions['state'] and replaced as a whole on reset, so
+    readers never observe a half-reset state.
+    """
+    vector_store: Optional[Chroma] = None
+    qa_chain: Optional[RetrievalQA] = None
+    document_metadata: Dict = field(default_factory=dict)
+    active_session_id: Optional[str] = None  # Track which session is currently active
+    warming: bool = False  # True while a restored vector store is still loading
+    restore_sig: Optional[tuple] = None  # Saved-state signature at the last restore
+    documents_json: Optional[bytes] = None  # Cached encoding of document_metadata; None when stale
+    wal_synced: bool = False  # True once the saved snapshot + WAL describe document_metadata
+
+app.extensions['state'] = AppState()
+
+def get_state() -> AppState:
+    """Return the current application state."""
+    return app.extensions['state']
+
+def _documents_json() -> bytes:
+    """
+    The document list encoded as JSON, cached until document_metadata changes.
+    Call with _meta_lock held; writers reset state.documents_json to None.
+    """
+    state = get_state()
+    if state.documents_json is None:
+        state.documents_json = orjson.dumps(state.document_metadata)
+    return state.documents_json
+
+def _documents_response(message: Optional[str] = None) -> Response:
+    """JSON response with the cached document list and an optional message."""
+    head = b'{"message":' + orjson.dumps(message) + b',' if message is not None else b'{'
+    return Response(head + b'"documents":' + _documents_json() + b'}', mimetype='application/json')
+
+# Chat sessions are kept in memory and written to disk by a background thread.
+# The cache is re-read if history.json changes on disk with no unsaved updates.
+# "order" lists session ids by updated_at, newest first, for the sidebar.
+# "gen" counts updates, so a finished write knows whether newer ones are pending.
+_sessions_cache = {"mtime_ns": None, "data": None, "dirty": False, "gen": 0, "order": []}
+_sessions_lock = threading.RLock()
+_persist_q = queue.Queue()
+
+# Guards document_metadata against concurrent upload/remove/snapshot
+_meta_lock = threading.RLock()
+# Serializes warm_index runs started by overlapping /restore calls
+_warm_lock = threading.Lock()
+# file_ids whose vectors are being added by an upload but aren't in document_metadata
+# yet; held while pruning the collection so in-flight uploads keep their vectors
+_indexing_lock = threading.Lock()
+_indexing_file_ids = set()
+
+# (fn, args) jobs for slow cleanup work (e.g. deleting uploads), run off the
+# request path by a single worker thread
+_cleanup_q = queue.Queue()
+_clear_lock = threading.Lock()
+
+# Shared keep-alive connection pool for Ollama embedding requests
+_ollama_http = requests.Session()
+_ollama_http.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+class ParallelOllamaEmbeddings(OllamaEmbeddings):
+    """
+    OllamaEmbeddings that sends document embedding requests concurrently
+    over a pooled session instead of one blocking request per chunk.
+    """
+    
+    def _process_emb_response(self, input: str) -> List[float]:
+        """Embed a single prompt through the shared connection pool."""
+        try:
+            res = _ollama_http.post(
+                f"{self.base_url}/api/embeddings",
+                json={"model": self.model, "prompt": input, **self._default_params}
+            )
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+        
+        if res.status_code != 200:
+            raise ValueError(f"Error raised by inference API HTTP code: {res.status_code}, {res.text}")
+        return res.json()["embedding"]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with up to EMBEDDING_WORKERS requests in flight."""
+        prompts = [f"{self.embed_instruction}{text}" for text in texts]
+        with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+            return list(executor.map(self._process_emb_response, prompts))
+
+# Shared Ollama clients, created once so connections are reused across requests
+_EMBEDDINGS = ParallelOllamaEmbeddings(
+    model="nomic-embed-text",
+    base_url="http://localhost:11434"
+)
+_LLM = Ollama(
+    model="llama3:8b",
+    base_url="http://localhost:11434",
+    temperature=0.3  # Lower temperature for more focused responses
+)
 
 def allowed_file(filename: str) -> bool:
     """Check if the uploaded file has an allowed extension."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    dot = filename.rfind('.')
+    return dot != -1 and filename[dot + 1:].lower() in ALLOWED_EXTENSIONS
 
-def load_chat_sessions() -> Dict:
+def _read_chat_sessions_file() -> Dict:
     """Load all chat sessions from JSON file."""
     try:
         if os.path.exists(CHAT_HISTORY_FILE):
-            with open(CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(CHAT_HISTORY_FILE, 'rb', buffering=IO_BUFFER_SIZE) as f:
+                data = orjson.loads(f.read())
                 # Migrate old format to new format if needed
                 if isinstance(data, list):
                     # Old format: convert to sessions
@@ -80,74 +229,242 @@ def load_chat_sessions() -> Dict:
                 return data
         return {"sessions": {}, "active_session": None}
     except Exception as e:
-        logger.error(f"Error loading chat sessions: {str(e)}")
+        logger.error("Error loading chat sessions: %s", e)
         return {"sessions": {}, "active_session": None}
 
+def _replay_history_log(data: Dict):
+    """Re-apply messages that were logged after the last history snapshot was written."""
+    log_paths = [path for path in (HISTORY_LOG_FILE + ROTATED_LOG_SUFFIX, HISTORY_LOG_FILE) if os.path.exists(path)]
+    if not log_paths:
+        return
+    
+    known_ids = {m['id'] for s in data['sessions'].values() for m in s['messages']}
+    replayed = 0
+    for log_path in log_paths:
+        with open(log_path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # Partially written line from a crash
+                session = data['sessions'].get(entry['session_id'])
+                message = entry['message']
+                if session is None or message['id'] in known_ids:
+                    continue
+                session['messages'].append(message)
+                session['name'] = entry['name']
+                session['updated_at'] = message['timestamp']
+                known_ids.add(message['id'])
+                replayed += 1
+    
+    if replayed:
+        logger.info("Replayed %s messages from history log", replayed)
+
+def _history_mtime_ns():
+    """Modification time of the history file, or None if it doesn't exist."""
+    try:
+        return os.stat(CHAT_HISTORY_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def load_chat_sessions() -> Dict:
+    """
+    Return the in-memory chat sessions, reloading them only when the file changed.
+    Callers mutate the returned dict under _sessions_lock and then call save_chat_sessions.
+    """
+    with _sessions_lock:
+        mtime_ns = _history_mtime_ns()
+        stale = not _sessions_cache["dirty"] and mtime_ns != _sessions_cache["mtime_ns"]
+        if _sessions_cache["data"] is None or stale:
+            data = _read_chat_sessions_file()
+            _replay_history_log(data)
+            _sessions_cache.update(data=data, mtime_ns=mtime_ns, order=_sorted_session_ids(data))
+        return _sessions_cache["data"]
+
 def save_chat_sessions(data: Dict):
-    """Save all chat sessions to JSON file."""
+    """Replace the in-memory chat sessions and schedule a background write to disk."""
+    with _sessions_lock:
+        if data is not _sessions_cache["data"]:
+            _sessions_cache["order"] = _sorted_session_ids(data)
+        _sessions_cache.update(data=data, dirty=True, gen=_sessions_cache["gen"] + 1)
+    _persist_q.put(_write_chat_sessions)
+
+def _sorted_session_ids(data: Dict) -> List[str]:
+    """Session ids sorted by updated_at (newest first)."""
+    sessions = data['sessions']
+    return sorted(sessions, key=lambda sid: sessions[sid]['updated_at'], reverse=True)
+
+def _touch_session(session_id: str):
+    """Move a just-updated session to the front of the sidebar order."""
+    with _sessions_lock:
+        order = _sessions_cache["order"]
+        if order and order[0] == session_id:
+            return
+        if session_id in order:
+            order.remove(session_id)
+        order.insert(0, session_id)
+
+def _write_chat_sessions(sync_dir: bool = True) -> bool:
+    """
+    Write chat sessions to the JSON file and drop the message log it now covers.
+    Only serialization and the log rotation happen under _sessions_lock; the write
+    and fsyncs don't block requests. With sync_dir=False the caller syncs the
+    directory and drops the rotated log. Returns True if the snapshot was written.
+    """
     try:
-        with open(CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with _sessions_lock:
+            data = _sessions_cache["data"]
+            if not data['sessions'] and data.get('active_session') is None:
+                payload = None
+            else:
+                payload = orjson.dumps(data)
+            gen = _sessions_cache["gen"]
+            _rotate_log(HISTORY_LOG_FILE)
+        
+        if payload is None:
+            # A missing history file already loads as empty sessions
+            try:
+                os.unlink(CHAT_HISTORY_FILE)
+            except FileNotFoundError:
+                pass
+        else:
+            _atomic_write(CHAT_HISTORY_FILE, payload)
+        
+        with _sessions_lock:
+            _sessions_cache.update(mtime_ns=_history_mtime_ns(), dirty=_sessions_cache["gen"] != gen)
+        if sync_dir:
+            _fsync_dir(CHAT_HISTORY_DIR)
+            _drop_rotated_log(HISTORY_LOG_FILE)
         logger.info("Chat sessions saved successfully")
+        return True
     except Exception as e:
-        logger.error(f"Error saving chat sessions: {str(e)}")
+        logger.error("Error saving chat sessions: %s", e)
+        return False
+
+def _atomic_write(path: str, data: bytes):
+    """
+    Write data to a temp file next to path, fsync it and os.replace it into place,
+    so readers never see a half-written file. Callers fsync the directory to make
+    the rename itself durable.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb', buffering=IO_BUFFER_SIZE) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _rotate_log(path: str):
+    """
+    Move a log aside before writing the snapshot that covers it, so appends made
+    during the write start a fresh log. Call with the lock guarding appends held.
+    If an earlier snapshot failed, its rotated log is kept and extended instead.
+    """
+    rotated_path = path + ROTATED_LOG_SUFFIX
+    if not os.path.exists(path):
+        return
+    if os.path.exists(rotated_path):
+        with open(path, 'rb') as src, open(rotated_path, 'ab') as dst:
+            dst.write(b'\n')  # Terminate a partial last line from a crash
+            shutil.copyfileobj(src, dst, IO_BUFFER_SIZE)
+        os.unlink(path)
+    else:
+        os.replace(path, rotated_path)
+
+def _drop_rotated_log(path: str):
+    """Delete a rotated log once the snapshot covering it is durable."""
+    try:
+        os.unlink(path + ROTATED_LOG_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+def _fsync_dir(path: str):
+    """Make renames inside a directory durable (no-op where directories can't be opened)."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _append_history_log(entry: Dict):
+    """Append one message to the history log so a crash loses at most one turn."""
+    with open(HISTORY_LOG_FILE, 'ab') as f:
+        f.write(orjson.dumps(entry) + b'\n')
+
+def _persist_worker():
+    """
+    Background writer for session files.
+    Waits a short debounce window, then drains the persistence queue and runs
+    each pending writer once, so bursts of updates collapse into one disk write.
+    """
+    while True:
+        writers = [_persist_q.get()]
+        time.sleep(PERSIST_DEBOUNCE_SECONDS)
+        while True:
+            try:
+                writers.append(_persist_q.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            for writer in dict.fromkeys(writers):
+                try:
+                    writer()
+                except Exception as e:
+                    logger.error("Persist job failed: %s", e)
+        finally:
+            for _ in writers:
+                _persist_q.task_done()
+
+threading.Thread(target=_persist_worker, name="persist-writer", daemon=True).start()
+# Flush pending writes before the interpreter exits
+atexit.register(_persist_q.join)
 
 def generate_chat_name(question: str) -> str:
     """Generate a chat name from the first question (max 50 chars)."""
-    # Take first question, limit length
     name = question.strip()
-    if len(name) > 50:
-        name = name[:47] + "..."
-    return name
+    return name if len(name) <= 50 else name[:47] + "..."
 
 def create_new_session(first_question: str = None) -> str:
     """Create a new chat session and return its ID."""
-    global document_metadata
-    
     try:
         session_id = str(uuid.uuid4())
-        sessions_data = load_chat_sessions()
         
-        # Generate name from first question or use default
-        if first_question:
-            name = generate_chat_name(first_question)
-        else:
-            name = f"New Chat {len(sessions_data['sessions']) + 1}"
+        # Store current document metadata with the session
+        with _meta_lock:
+            docs_snapshot = get_state().document_metadata.copy()
         
-        # Store current document metadata with the session (safe copy)
-        try:
-            docs_snapshot = dict(document_metadata) if document_metadata else {}
-        except Exception as e:
-            logger.warning(f"Failed to snapshot documents: {str(e)}")
-            docs_snapshot = {}
-        
-        sessions_data['sessions'][session_id] = {
-            "id": session_id,
-            "name": name,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-            "messages": [],
-            "documents": docs_snapshot
-        }
-        sessions_data['active_session'] = session_id
-        save_chat_sessions(sessions_data)
-        logger.info(f"✓ Created new session: {session_id} - {name} with {len(docs_snapshot)} documents")
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            
+            # Generate name from first question or use default
+            if first_question:
+                name = generate_chat_name(first_question)
+            else:
+                name = f"New Chat {len(sessions_data['sessions']) + 1}"
+            
+            sessions_data['sessions'][session_id] = {
+                "id": session_id,
+                "name": name,
+                "created_at": datetime.now().isoformat(),
+                "updated_at": datetime.now().isoformat(),
+                "messages": [],
+                "documents": docs_snapshot
+            }
+            sessions_data['active_session'] = session_id
+            _touch_session(session_id)
+            save_chat_sessions(sessions_data)
+        logger.info("✓ Created new session: %s - %s with %s documents", session_id, name, len(docs_snapshot))
         return session_id
     except Exception as e:
-        logger.error(f"Error creating session: {str(e)}")
+        logger.error("Error creating session: %s", e)
         raise
 
 def add_message_to_session(session_id: str, question: str, answer: str, citations: List[Dict]):
     """Add a message to a specific chat session."""
-    global document_metadata
-    
     try:
-        sessions_data = load_chat_sessions()
-        
-        if session_id not in sessions_data['sessions']:
-            logger.error(f"❌ Session {session_id} not found")
-            return False
-        
         message = {
             "id": str(uuid.uuid4()),
             "timestamp": datetime.now().isoformat(),
@@ -156,107 +473,285 @@ def add_message_to_session(session_id: str, question: str, answer: str, citation
             "citations": citations
         }
         
-        sessions_data['sessions'][session_id]['messages'].append(message)
-        sessions_data['sessions'][session_id]['updated_at'] = datetime.now().isoformat()
-        
-        # Update session name if this is the first message
-        if len(sessions_data['sessions'][session_id]['messages']) == 1:
-            new_name = generate_chat_name(question)
-            sessions_data['sessions'][session_id]['name'] = new_name
-            logger.info(f"✓ Renamed session to: {new_name}")
-        
-        # Update documents snapshot if not present
-        if 'documents' not in sessions_data['sessions'][session_id]:
-            try:
-                sessions_data['sessions'][session_id]['documents'] = dict(document_metadata) if document_metadata else {}
-            except Exception as e:
-                logger.warning(f"Failed to add documents to session: {str(e)}")
-                sessions_data['sessions'][session_id]['documents'] = {}
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            
+            if session_id not in sessions_data['sessions']:
+                logger.error("❌ Session %s not found", session_id)
+                return False
+            
+            session = sessions_data['sessions'][session_id]
+            session['messages'].append(message)
+            session['updated_at'] = message['timestamp']
+            
+            # Update session name if this is the first message
+            if len(session['messages']) == 1:
+                new_name = generate_chat_name(question)
+                session['name'] = new_name
+                logger.info("✓ Renamed session to: %s", new_name)
+            
+            # Update documents snapshot if not present
+            if 'documents' not in session:
+                with _meta_lock:
+                    session['documents'] = get_state().document_metadata.copy()
+            
+            _append_history_log({"session_id": session_id, "name": session['name'], "message": message})
+            _touch_session(session_id)
+            save_chat_sessions(sessions_data)
+            message_count = len(session['messages'])
         
-        save_chat_sessions(sessions_data)
-        message_count = len(sessions_data['sessions'][session_id]['messages'])
-        logger.info(f"✓ Added message to session {session_id} (total: {message_count} messages)")
+        logger.info("✓ Added message to session %s (total: %s messages)", session_id, message_count)
         return True
     except Exception as e:
-        logger.error(f"❌ Error adding message to session: {str(e)}")
+        logger.error("❌ Error adding message to session: %s", e)
         return False
 
 def save_session_state():
-    """Save current session state (document metadata and file paths) to JSON."""
+    """Schedule a background snapshot of the session state (also compacts the WAL)."""
+    _persist_q.put(_write_session_state)
+
+def _write_session_state(sync_dir: bool = True) -> bool:
+    """
+    Save current session state (document metadata and file paths) to JSON and drop
+    the WAL it now covers. Only serialization and the WAL rotation happen under
+    _meta_lock. With sync_dir=False the caller syncs the directory and drops the
+    rotated WAL. Returns True if the snapshot was written.
+    """
     try:
-        session_data = {
-            "document_metadata": document_metadata,
-            "last_updated": datetime.now().isoformat()
-        }
-        with open(SESSION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, indent=2)
+        with _meta_lock:
+            session_data = {
+                "document_metadata": get_state().document_metadata,
+                "last_updated": datetime.now().isoformat()
+            }
+            payload = orjson.dumps(session_data, option=orjson.OPT_INDENT_2)
+            _rotate_log(SESSION_WAL_FILE)
+        
+        _atomic_write(SESSION_FILE, payload)
+        if sync_dir:
+            _fsync_dir(CHAT_HISTORY_DIR)
+            # Every logged change is now part of the snapshot
+            _drop_rotated_log(SESSION_WAL_FILE)
         logger.info("Session state saved")
+        return True
     except Exception as e:
-        logger.error(f"Error saving session state: {str(e)}")
+        logger.error("Error saving session state: %s", e)
+        return False
+
+def save_all_state(chat_sessions: Dict):
+    """
+    Replace the in-memory chat sessions and schedule one background write of both
+    the session state and chat sessions, sharing a single directory fsync.
+    """
+    with _sessions_lock:
+        _sessions_cache.update(data=chat_sessions, dirty=True, gen=_sessions_cache["gen"] + 1,
+                               order=_sorted_session_ids(chat_sessions))
+    _persist_q.put(_write_all_state)
+
+def _write_all_state():
+    """Snapshot session state and chat sessions together (both live in CHAT_HISTORY_DIR)."""
+    wrote_state = _write_session_state(sync_dir=False)
+    wrote_sessions = _write_chat_sessions(sync_dir=False)
+    try:
+        _fsync_dir(CHAT_HISTORY_DIR)
+    except OSError as e:
+        logger.error("Error syncing state directory: %s", e)
+        return
+    # The logs are only dropped once both renames are durable
+    if wrote_state:
+        _drop_rotated_log(SESSION_WAL_FILE)
+    if wrote_sessions:
+        _drop_rotated_log(HISTORY_LOG_FILE)
+
+def _log_session_op(op: Dict):
+    """
+    Append one document_metadata change to the session WAL.
+    Call with _meta_lock held, right after applying the change in memory, so
+    the log order matches the in-memory order. Large WALs are compacted in
+    the background by rewriting the snapshot.
+    Until this process has restored (or logged) its state, the saved state
+    belongs to an earlier run, so the first record is preceded by a reset.
+    """
+    try:
+        with _meta_lock:
+            state = get_state()
+            with open(SESSION_WAL_FILE, 'ab') as f:
+                if not state.wal_synced and op['op'] != 'reset':
+                    f.write(orjson.dumps({"op": "reset", "ts": datetime.now().isoformat()}) + b'\n')
+                f.write(orjson.dumps({**op, "ts": datetime.now().isoformat()}) + b'\n')
+                wal_size = f.tell()
+            state.wal_synced = True
+        if wal_size > SESSION_WAL_COMPACT_BYTES:
+            save_session_state()
+    except Exception as e:
+        logger.error("Error logging session change: %s", e)
+
+def _replay_session_wal(session_data: Dict, wal_path: str):
+    """Apply the changes logged since the last snapshot to the loaded session state."""
+    metadata = session_data.setdefault('document_metadata', {})
+    with open(wal_path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+        for line in f:
+            try:
+                op = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue  # Partially written line from a crash
+            if op['op'] == 'put':
+                metadata[op['file_id']] = op['metadata']
+            elif op['op'] == 'delete':
+                metadata.pop(op['file_id'], None)
+            elif op['op'] == 'reset':
+                metadata.clear()
+
+def _read_json_mmap(path: str) -> Dict:
+    """Parse a JSON file straight from a read-only memory map, without copying it into a buffer."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
 
 def load_session_state() -> Dict:
-    """Load session state from JSON."""
+    """Load session state from the JSON snapshot plus any changes logged in the WAL."""
     try:
+        session_data = {}
         if os.path.exists(SESSION_FILE):
-            with open(SESSION_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+            session_data = _read_json_mmap(SESSION_FILE)
+        # A rotated WAL is left behind if the process stopped mid-snapshot
+        for wal_path in (SESSION_WAL_FILE + ROTATED_LOG_SUFFIX, SESSION_WAL_FILE):
+            if os.path.exists(wal_path):
+                _replay_session_wal(session_data, wal_path)
+        return session_data
     except Exception as e:
-        logger.error(f"Error loading session state: {str(e)}")
+        logger.error("Error loading session state: %s", e)
         return {}
 
-def restore_session():
+def _load_and_chunk(task: tuple) -> List:
+    """Load and chunk one saved document. Runs in a worker process during restore."""
+    file_id, file_path, filename = task
+    documents = load_document(file_path)
+    for doc in documents:
+        doc.metadata['source'] = filename
+        doc.metadata['file_id'] = file_id
+    return chunk_documents(documents)
+
+def _session_state_signature() -> tuple:
+    """Cheap (mtime, size) signature of the saved session snapshot and WAL."""
+    signature = []
+    for path in (SESSION_FILE, SESSION_WAL_FILE):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def restore_metadata() -> Dict:
     """
-    Restore previous session by reloading documents and rebuilding vector store.
-    Called on backend startup if session file exists.
+    Restore the saved document metadata (fast part of a session restore).
+    Returns a copy of the restored metadata, or an empty dict if there is nothing to restore.
+    The vector store is brought up afterwards by warm_index().
     """
-    global document_metadata, vector_store, qa_chain, all_documents
+    session_data = load_session_state()
+    if not session_data or 'document_metadata' not in session_data:
+        logger.info("No previous session found")
+        return {}
     
-    try:
-        session_data = load_session_state()
-        if not session_data or 'document_metadata' not in session_data:
-            logger.info("No previous session found")
-            return False
-        
-        document_metadata = session_data['document_metadata']
-        
-        if not document_metadata:
-            logger.info("No documents in previous session")
-            return False
-        
-        logger.info(f"Restoring session with {len(document_metadata)} documents...")
-        
-        # Reload all documents from uploads folder
-        all_chunks = []
-        for file_id, metadata in document_metadata.items():
-            # Find the file in uploads
-            for filename in os.listdir(UPLOAD_FOLDER):
-                if filename.startswith(file_id):
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    
-                    # Load and chunk the document
-                    documents = load_document(file_path)
-                    for doc in documents:
-                        doc.metadata['source'] = metadata['filename']
-                        doc.metadata['file_id'] = file_id
-                    
-                    chunks = chunk_documents(documents)
-                    all_chunks.extend(chunks)
-                    logger.info(f"Reloaded: {metadata['filename']}")
-                    break
-        
-        if all_chunks:
-            # Rebuild vector store
-            create_vector_store(all_chunks, collection_name="docuchat_multi", add_to_existing=False)
-            initialize_qa_chain()
-            logger.info(f"Session restored successfully with {len(all_chunks)} chunks")
-            return True
-        
-        return False
-        
-    except Exception as e:
-        logger.error(f"Error restoring session: {str(e)}")
-        return False
+    with _meta_lock:
+        state = get_state()
+        state.document_metadata = session_data['document_metadata']
+        state.documents_json = None
+        state.wal_synced = True
+        saved_documents = session_data['document_metadata'].copy()
+        state.warming = bool(saved_documents)
+    
+    if not saved_documents:
+        logger.info("No documents in previous session")
+    return saved_documents
+
+def warm_index(saved_documents: Dict):
+    """
+    Bring up the vector store for restored documents (slow part of a session restore).
+    Reopens the persisted collection, re-embeds only documents whose vectors are
+    missing, then runs one query so the index and embedding model are loaded
+    before the first question.
+    """
+    state = get_state()
+    
+    # One warm-up at a time, so concurrent restores never embed the same file twice
+    with _warm_lock:
+        try:
+            logger.info("Restoring session with %s documents...", len(saved_documents))
+            
+            # Reopen the persisted collection instead of rebuilding it: drop vectors of
+            # documents that are no longer in the session, and only re-embed documents
+            # whose vectors are missing
+            vector_store = _open_documents_store()
+            collection = vector_store._collection
+            # Keep documents uploaded since the restore began, which this run may
+            # have waited on _warm_lock for
+            with _indexing_lock:
+                keep = set(saved_documents).union(_live_file_ids())
+                collection.delete(where={"file_id": {"$nin": list(keep)}})
+            missing = [file_id for file_id in saved_documents
+                       if not collection.get(where={"file_id": file_id}, limit=1, include=[])['ids']]
+            logger.info("%s documents already indexed, %s to rebuild",
+                        len(saved_documents) - len(missing), len(missing))
+            
+            # Locate each missing document; older sessions don't store the path,
+            # so fall back to a single scan of the uploads folder
+            uploads_by_id = None
+            tasks = []
+            for file_id in missing:
+                metadata = saved_documents[file_id]
+                file_path = metadata.get('path')
+                if not file_path:
+                    if uploads_by_id is None:
+                        uploads_by_id = {filename.split('_', 1)[0]: filename for filename in os.listdir(UPLOAD_FOLDER)}
+                    filename = uploads_by_id.get(file_id)
+                    file_path = os.path.join(UPLOAD_FOLDER, filename) if filename else None
+                if file_path and os.path.exists(file_path):
+                    tasks.append((file_id, file_path, metadata['filename']))
+            
+            # Load and chunk the documents in parallel (parsing is CPU-bound)
+            all_chunks = []
+            if tasks:
+                with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as executor:
+                    for (_, _, filename), chunks in zip(tasks, executor.map(_load_and_chunk, tasks)):
+                        all_chunks.extend(chunks)
+                        logger.info("Reloaded: %s", filename)
+            
+            # Stop if the state was cleared while documents were loading
+            if get_state() is not state:
+                return
+            
+            if all_chunks:
+                _bulk_add(vector_store, all_chunks, _EMBEDDINGS)
+            
+            # Drop documents that were removed while the index was warming
+            with _meta_lock:
+                removed = [file_id for file_id in saved_documents if file_id not in state.document_metadata]
+            if removed:
+                collection.delete(where={"file_id": {"$in": removed}})
+            
+            if collection.count() == 0:
+                logger.info("No indexed documents to restore")
+                return
+            
+            # Load the index and the embedding model ahead of the first question
+            vector_store.similarity_search("warm up", k=1)
+            
+            with _meta_lock:
+                # Don't install the store on a state that was cleared meanwhile
+                if get_state() is not state:
+                    return
+                state.active_session_id = None
+                state.vector_store = vector_store
+                initialize_qa_chain(state)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Session restored successfully with %s chunks", collection.count())
+        except Exception as e:
+            logger.error("Error restoring session: %s", e)
+        finally:
+            state.warming = False
 
 def load_document(file_path: str) -> List:
     """
@@ -267,7 +762,7 @@ def load_document(file_path: str) -> List:
     
     try:
         if file_extension == 'pdf':
-            loader = PyPDFLoader(file_path)
+            loader = PyMuPDFLoader(file_path)
             documents = loader.load()
         elif file_extension in ['docx', 'doc']:
             # Try UnstructuredWordDocumentLoader first
@@ -275,78 +770,125 @@ def load_document(file_path: str) -> List:
                 loader = UnstructuredWordDocumentLoader(file_path)
                 documents = loader.load()
             except Exception as e:
-                logger.warning(f"UnstructuredWordDocumentLoader failed: {str(e)}, trying python-docx directly")
+                logger.warning("UnstructuredWordDocumentLoader failed: %s, trying python-docx directly", e)
                 # Fallback: Use python-docx directly
                 import docx
                 doc = docx.Document(file_path)
                 text = "\n\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()])
                 
-                from langchain.schema import Document
                 documents = [Document(page_content=text, metadata={"source": file_path})]
         else:
             raise ValueError(f"Unsupported file type: {file_extension}")
         
-        logger.info(f"✓ Loaded {len(documents)} pages/sections from {file_path}")
+        logger.info("✓ Loaded %s pages/sections from %s", len(documents), file_path)
         return documents
     except Exception as e:
-        logger.error(f"❌ Error loading document: {str(e)}")
+        logger.error("❌ Error loading document: %s", e)
         raise
 
 def chunk_documents(documents: List, chunk_size: int = 1000, chunk_overlap: int = 200) -> List:
     """
-    Split documents into semantic chunks using RecursiveCharacterTextSplitter.
-    This ensures better context preservation and retrieval accuracy.
+    Split documents into semantic chunks using the native semantic-text-splitter.
+    It splits on the same paragraph/line/word boundaries as a recursive splitter
+    and never exceeds chunk_size; tiny neighbouring chunks are then merged.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    text_splitter = TextSplitter(capacity=chunk_size, overlap=chunk_overlap)
     
-    chunks = text_splitter.split_documents(documents)
-    logger.info(f"Created {len(chunks)} chunks from documents")
+    chunks = []
+    for doc in documents:
+        text = doc.page_content
+        spans = [(start, start + len(chunk)) for start, chunk in text_splitter.chunk_indices(text)]
+        chunks.extend(
+            Document(page_content=text[start:end], metadata=dict(doc.metadata))
+            for start, end in _merge_small_spans(spans, max_size=int(chunk_size * 1.05))
+        )
+    
+    logger.info("Created %s chunks from documents", len(chunks))
     return chunks
 
-def create_vector_store(chunks: List, collection_name: str = "docuchat", add_to_existing: bool = False, session_id: str = None):
+def _merge_small_spans(spans: List[tuple], max_size: int) -> List[tuple]:
+    """
+    Greedily merge adjacent (start, end) chunk spans of one page while the text
+    they cover fits in max_size. Merged chunks are sliced from the page, so the
+    overlap between neighbours appears once. Fewer, fuller chunks mean fewer
+    embedding calls.
+    """
+    merged = []
+    for start, end in spans:
+        if merged and end - merged[-1][0] <= max_size:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            continue
+        merged.append((start, end))
+    return merged
+
+def _bulk_add(store: Chroma, chunks: List, embeddings: ParallelOllamaEmbeddings, batch_size: int = CHROMA_BATCH_SIZE):
+    """
+    Insert chunks into a Chroma store in large batches.
+    Embeddings are computed once per batch outside Chroma, and each batch is
+    written with a single collection.add() call to amortize per-call overhead.
+    """
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        texts = [chunk.page_content for chunk in batch]
+        store._collection.add(
+            ids=[str(uuid.uuid4()) for _ in batch],
+            documents=texts,
+            embeddings=embeddings.embed_documents(texts),
+            metadatas=[chunk.metadata for chunk in batch]
+        )
+
+def _open_documents_store() -> Chroma:
+    """Open the persisted documents collection."""
+    return Chroma(
+        collection_name=DOCUMENTS_COLLECTION,
+        embedding_function=_EMBEDDINGS,
+        persist_directory=CHROMA_DB_DIR
+    )
+
+def _documents_store(state: AppState) -> Chroma:
+    """
+    The store holding the uploaded documents: the open one if it is the documents
+    collection, otherwise (nothing loaded yet, e.g. a restore still warming, or a
+    session collection open) the persisted documents collection.
+    """
+    vector_store = state.vector_store
+    if vector_store is None or vector_store._collection.name != DOCUMENTS_COLLECTION:
+        vector_store = _open_documents_store()
+    return vector_store
+
+def create_vector_store(chunks: List, collection_name: str = DOCUMENTS_COLLECTION, session_id: str = None):
     """
     Create or update a session-specific Chroma vector store with Ollama embeddings.
     Each session has its own isolated vector store to keep documents separate.
     Uses local Ollama instance for embedding generation.
     """
-    global vector_store, all_documents, active_session_id
+    state = get_state()
     
     try:
-        # Initialize Ollama embeddings (using nomic-embed-text for embeddings)
-        embeddings = OllamaEmbeddings(
-            model="nomic-embed-text",
-            base_url="http://localhost:11434"
-        )
-        
         # Use session-specific collection name if session_id provided
         if session_id:
             collection_name = f"session_{session_id}"
             
-        if add_to_existing and vector_store is not None and active_session_id == session_id:
+        # A fresh Chroma object would open the same persisted collection, so reuse the
+        # open store (also after /clear, which empties it in place)
+        if state.vector_store is not None and state.active_session_id == session_id:
             # Add new documents to existing vector store (same session)
-            all_documents.extend(chunks)
-            vector_store.add_documents(chunks)
-            logger.info(f"Added {len(chunks)} chunks to session {session_id}")
+            _bulk_add(state.vector_store, chunks, _EMBEDDINGS)
+            logger.info("Added %s chunks to session %s", len(chunks), session_id)
         else:
             # Create new Chroma vector store for this session
-            all_documents = chunks
-            active_session_id = session_id
-            vector_store = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
+            state.active_session_id = session_id
+            state.vector_store = Chroma(
                 collection_name=collection_name,
+                embedding_function=_EMBEDDINGS,
                 persist_directory=CHROMA_DB_DIR
             )
-            logger.info(f"✓ Vector store created for session {session_id} with {len(chunks)} chunks")
+            _bulk_add(state.vector_store, chunks, _EMBEDDINGS)
+            logger.info("✓ Vector store created for session %s with %s chunks", session_id, len(chunks))
         
-        return vector_store
+        return state.vector_store
     except Exception as e:
-        logger.error(f"Error creating/updating vector store: {str(e)}")
+        logger.error("Error creating/updating vector store: %s", e)
         raise
 
 def load_session_vector_store(session_id: str):
@@ -354,60 +896,37 @@ def load_session_vector_store(session_id: str):
     Load the vector store for a specific session.
     This allows switching between sessions with different documents.
     """
-    global vector_store, active_session_id, qa_chain
+    state = get_state()
     
     try:
         # If already loaded for this session, skip
-        if active_session_id == session_id and vector_store is not None:
-            logger.info(f"Vector store already loaded for session {session_id}")
+        if state.active_session_id == session_id and state.vector_store is not None:
+            logger.info("Vector store already loaded for session %s", session_id)
             return True
         
-        # Load vector store for this session
-        embeddings = OllamaEmbeddings(
-            model="nomic-embed-text",
-            base_url="http://localhost:11434"
-        )
-        
         collection_name = f"session_{session_id}"
-        logger.info(f"Loading vector store for session {session_id}")
+        logger.info("Loading vector store for session %s", session_id)
         
-        vector_store = Chroma(
+        state.vector_store = Chroma(
             collection_name=collection_name,
-            embedding_function=embeddings,
+            embedding_function=_EMBEDDINGS,
             persist_directory=CHROMA_DB_DIR
         )
         
-        active_session_id = session_id
+        state.active_session_id = session_id
         
         # Reinitialize QA chain with the loaded vector store
         initialize_qa_chain()
         
-        logger.info(f"✓ Vector store loaded for session {session_id}")
+        logger.info("✓ Vector store loaded for session %s", session_id)
         return True
     except Exception as e:
-        logger.error(f"Failed to load vector store for session {session_id}: {str(e)}")
+        logger.error("Failed to load vector store for session %s: %s", session_id, e)
         return False
 
-def initialize_qa_chain():
-    """
-    Initialize the RetrievalQA chain with Ollama LLM.
-    This chain handles question answering with source citations.
-    """
-    global qa_chain, vector_store
-    
-    if vector_store is None:
-        raise ValueError("Vector store not initialized")
-    
-    try:
-        # Initialize Ollama LLM (llama3:8b)
-        llm = Ollama(
-            model="llama3:8b",
-            base_url="http://localhost:11434",
-            temperature=0.3  # Lower temperature for more focused responses
-        )
-        
-        # Custom prompt template for better responses with citations
-        prompt_template = """You are a helpful AI assistant that answers questions based on the provided context from uploaded documents. 
+# Custom prompt template for better responses with citations
+QA_PROMPT = PromptTemplate(
+    template="""You are a helpful AI assistant that answers questions based on the provided context from uploaded documents. 
         Use the following pieces of context to answer the question at the end. 
         If you don't know the answer or if it's not in the context, just say that you don't have enough information to answer, don't try to make up an answer.
         Always be specific and cite the relevant parts of the context in your answer.
@@ -416,29 +935,39 @@ Context: {context}
 
 Question: {question}
 
-Answer: Let me help you with that based on the document."""
-        
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
-        
+Answer: Let me help you with that based on the document.""",
+    input_variables=["context", "question"]
+)
+
+def initialize_qa_chain(state: Optional[AppState] = None):
+    """
+    Initialize the RetrievalQA chain with Ollama LLM.
+    This chain handles question answering with source citations.
+    Uses the current state unless one is passed in.
+    """
+    if state is None:
+        state = get_state()
+    
+    if state.vector_store is None:
+        raise ValueError("Vector store not initialized")
+    
+    try:
         # Create RetrievalQA chain with source documents return
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
+        state.qa_chain = RetrievalQA.from_chain_type(
+            llm=_LLM,
             chain_type="stuff",
-            retriever=vector_store.as_retriever(
+            retriever=state.vector_store.as_retriever(
                 search_type="similarity",
                 search_kwargs={"k": 4}  # Retrieve top 4 most relevant chunks
             ),
             return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
+            chain_type_kwargs={"prompt": QA_PROMPT}
         )
         
         logger.info("QA chain initialized successfully")
-        return qa_chain
+        return state.qa_chain
     except Exception as e:
-        logger.error(f"Error initializing QA chain: {str(e)}")
+        logger.error("Error initializing QA chain: %s", e)
         raise
 
 @app.route('/health', methods=['GET'])
@@ -456,8 +985,6 @@ def upload_document():
     Processes the document, creates embeddings, and stores in vector database.
     Supports adding to existing collection or creating new one.
     """
-    global document_metadata
-    
     # Check if file is in request
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
@@ -475,14 +1002,19 @@ def upload_document():
     # Check if this is adding to existing documents
     add_to_existing = request.form.get('add_to_existing', 'false').lower() == 'true'
     
+    # Register the upload so a concurrent /clear or restore keeps its file and vectors
+    file_id = str(uuid.uuid4())
+    with _indexing_lock:
+        _indexing_file_ids.add(file_id)
+    
     try:
         # Secure the filename and save
         filename = secure_filename(file.filename)
-        file_id = str(uuid.uuid4())
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}_{filename}")
-        file.save(file_path)
+        with open(file_path, 'wb') as out:
+            shutil.copyfileobj(file.stream, out, length=IO_BUFFER_SIZE)
         
-        logger.info(f"File uploaded: {filename} (add_to_existing: {add_to_existing})")
+        logger.info("File uploaded: %s (add_to_existing: %s)", filename, add_to_existing)
         
         # Load document
         documents = load_document(file_path)
@@ -496,22 +1028,25 @@ def upload_document():
         chunks = chunk_documents(documents)
         
         # Create or update vector store (no session tracking - simple mode)
-        create_vector_store(chunks, collection_name="docuchat", add_to_existing=add_to_existing, session_id=None)
+        create_vector_store(chunks, collection_name=DOCUMENTS_COLLECTION, session_id=None)
         
         # Initialize or update QA chain
         initialize_qa_chain()
         
         # Store document metadata
-        document_metadata[file_id] = {
-            "filename": filename,
-            "chunks": len(chunks),
-            "pages": len(documents)
-        }
-        
-        # Save session state for persistence
-        save_session_state()
-        
-        total_documents = len(document_metadata)
+        with _meta_lock:
+            document_metadata = get_state().document_metadata
+            document_metadata[file_id] = {
+                "filename": filename,
+                "chunks": len(chunks),
+                "pages": len(documents),
+                "path": file_path
+            }
+            total_documents = len(document_metadata)
+            get_state().documents_json = None
+            
+            # Log the change for persistence
+            _log_session_op({"op": "put", "file_id": file_id, "metadata": document_metadata[file_id]})
         
         return jsonify({
             "message": "Document uploaded and processed successfully" if not add_to_existing else "Document added to collection",
@@ -523,25 +1058,39 @@ def upload_document():
         }), 200
         
     except Exception as e:
-        logger.error(f"Error processing upload: {str(e)}")
+        logger.error("Error processing upload: %s", e)
         return jsonify({"error": f"Failed to process document: {str(e)}"}), 500
+    finally:
+        with _indexing_lock:
+            _indexing_file_ids.discard(file_id)
 
 def format_citation_text(text: str, max_sentences: int = 3) -> str:
     """
     Format citation text to show only 2-3 sentences.
     Truncates long text and adds ellipsis if needed.
+    Scans sentence boundaries only as far as the output needs.
     """
-    import re
+    text = text.strip()
     
-    # Split into sentences (basic approach)
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    # Collect sentences until max_sentences or the length cap is reached
+    selected = []
+    length = 0
+    start = 0
+    truncated = False
+    for match in _SENT_SPLIT_RE.finditer(text):
+        selected.append(text[start:match.start()])
+        start = match.end()
+        length += len(selected[-1]) + 1
+        if len(selected) == max_sentences or length > 300:
+            truncated = True
+            break
+    else:
+        selected.append(text[start:])
     
-    # Take first max_sentences
-    selected = sentences[:max_sentences]
     result = ' '.join(selected)
     
     # Add ellipsis if we truncated
-    if len(sentences) > max_sentences:
+    if truncated:
         result += '...'
     
     # Limit total length as backup
@@ -550,6 +1099,15 @@ def format_citation_text(text: str, max_sentences: int = 3) -> str:
     
     return result
 
+def format_citations(source_docs: List) -> List[Dict]:
+    """Build the citation list returned with an answer from its source documents."""
+    return [{
+        "id": i,
+        "content": format_citation_text(doc.page_content, max_sentences=3),
+        "source": doc.metadata.get('source', 'Unknown'),
+        "page": doc.metadata.get('page', 'N/A')
+    } for i, doc in enumerate(source_docs, 1)]
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """
@@ -558,10 +1116,13 @@ def chat():
     Automatically saves conversation to active chat session.
     Citations are formatted as 2-3 sentences with page numbers.
     """
-    global qa_chain
+    state = get_state()
+    qa_chain = state.qa_chain
     
     # Check if QA chain is initialized
     if qa_chain is None:
+        if state.warming:
+            return jsonify({"error": "Documents are still loading. Please try again shortly."}), 503
         return jsonify({"error": "No document uploaded yet. Please upload a document first."}), 400
     
     # Get question and session_id from request
@@ -580,17 +1141,9 @@ def chat():
         source_docs = result['source_documents']
         
         # Format source citations (shortened to 2-3 sentences)
-        citations = []
-        for i, doc in enumerate(source_docs):
-            formatted_text = format_citation_text(doc.page_content, max_sentences=3)
-            citations.append({
-                "id": i + 1,
-                "content": formatted_text,
-                "source": doc.metadata.get('source', 'Unknown'),
-                "page": doc.metadata.get('page', 'N/A')
-            })
+        citations = format_citations(source_docs)
         
-        logger.info(f"Question answered: {question[:50]}...")
+        logger.info("Question answered: %s...", question[:50])
         
         return jsonify({
             "answer": answer,
@@ -599,119 +1152,175 @@ def chat():
         }), 200
         
     except Exception as e:
-        logger.error(f"Error processing chat: {str(e)}")
+        logger.error("Error processing chat: %s", e)
         return jsonify({"error": f"Failed to process question: {str(e)}"}), 500
 
+def _sse_event(payload: Dict) -> bytes:
+    """Encode one Server-Sent Events message."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Sends answer tokens as the LLM generates them, then a final event
+    with the citations, so the client sees output after the first token.
+    """
+    state = get_state()
+    qa_chain = state.qa_chain
+    
+    # Check if QA chain is initialized
+    if qa_chain is None:
+        if state.warming:
+            return jsonify({"error": "Documents are still loading. Please try again shortly."}), 503
+        return jsonify({"error": "No document uploaded yet. Please upload a document first."}), 400
+    
+    data = request.get_json()
+    if not data or 'question' not in data:
+        return jsonify({"error": "No question provided"}), 400
+    
+    question = data['question']
+    
+    try:
+        # Retrieve context up front so citations are known before generation starts
+        source_docs = qa_chain.retriever.get_relevant_documents(question)
+        context = "\n\n".join(doc.page_content for doc in source_docs)
+        prompt = QA_PROMPT.format(context=context, question=question)
+        citations = format_citations(source_docs)
+    except Exception as e:
+        logger.error("Error processing chat: %s", e)
+        return jsonify({"error": f"Failed to process question: {str(e)}"}), 500
+    
+    def generate():
+        try:
+            for token in _LLM.stream(prompt):
+                yield _sse_event({"token": token})
+            yield _sse_event({"done": True, "citations": citations, "question": question})
+            logger.info("Question answered (streamed): %s...", question[:50])
+        except Exception as e:
+            logger.error("Error streaming chat: %s", e)
+            yield _sse_event({"error": f"Failed to process question: {str(e)}"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/documents', methods=['GET'])
 def get_documents():
     """Endpoint to retrieve list of uploaded documents."""
-    return jsonify({
-        "documents": document_metadata
-    }), 200
+    with _meta_lock:
+        return _documents_response(), 200
 
 @app.route('/documents/<file_id>', methods=['DELETE'])
 def remove_document(file_id):
     """
     Endpoint to remove a specific document from the collection.
-    Note: This requires rebuilding the vector store without the removed document.
+    Only the removed document's vectors are deleted from the vector store.
     """
-    global document_metadata, vector_store, qa_chain, all_documents
+    state = get_state()
     
-    if file_id not in document_metadata:
+    # Remove from metadata
+    with _meta_lock:
+        metadata = state.document_metadata.pop(file_id, None)
+        remaining_documents = len(state.document_metadata)
+        if metadata is not None:
+            state.documents_json = None
+            # Log the change for persistence
+            _log_session_op({"op": "delete", "file_id": file_id})
+    if metadata is None:
         return jsonify({"error": "Document not found"}), 404
     
     try:
-        # Get filename before removing
-        filename = document_metadata[file_id]['filename']
-        
-        # Remove from metadata
-        del document_metadata[file_id]
+        filename = metadata['filename']
         
         # Remove uploaded file
-        for file in os.listdir(UPLOAD_FOLDER):
-            if file.startswith(file_id):
-                os.remove(os.path.join(UPLOAD_FOLDER, file))
-        
-        # Filter out chunks belonging to this document
-        remaining_docs = [doc for doc in all_documents if doc.metadata.get('file_id') != file_id]
-        
-        # Rebuild vector store if there are remaining documents
-        if remaining_docs:
-            all_documents = remaining_docs
-            create_vector_store(remaining_docs, collection_name="docuchat_multi", add_to_existing=False)
-            initialize_qa_chain()
+        file_path = metadata.get('path')
+        if file_path:
+            if os.path.exists(file_path):
+                os.remove(file_path)
         else:
-            # No documents left, clear everything
-            vector_store = None
-            qa_chain = None
-            all_documents = []
+            for file in os.listdir(UPLOAD_FOLDER):
+                if file.startswith(file_id):
+                    os.remove(os.path.join(UPLOAD_FOLDER, file))
+        
+        # Delete this document's vectors in place; the QA chain's retriever
+        # is bound to vector_store, so it needs no rebuild
+        vector_store = _documents_store(state)
+        vector_store._collection.delete(where={"file_id": file_id})
         
-        # Update session state
-        save_session_state()
+        if vector_store._collection.count() == 0:
+            # No documents left; keep the empty store open for the next upload
+            state.qa_chain = None
         
-        logger.info(f"Document removed: {filename}")
+        logger.info("Document removed: %s", filename)
         
         return jsonify({
             "message": f"Document '{filename}' removed successfully",
-            "remaining_documents": len(document_metadata)
+            "remaining_documents": remaining_documents
         }), 200
         
     except Exception as e:
-        logger.error(f"Error removing document: {str(e)}")
+        logger.error("Error removing document: %s", e)
         return jsonify({"error": f"Failed to remove document: {str(e)}"}), 500
 
 @app.route('/chat/sessions', methods=['GET'])
 def get_chat_sessions():
     """Endpoint to retrieve all chat sessions (sidebar list)."""
     try:
-        sessions_data = load_chat_sessions()
-        # Return sessions as a list, sorted by updated_at (newest first)
-        sessions_list = list(sessions_data['sessions'].values())
-        sessions_list.sort(key=lambda x: x['updated_at'], reverse=True)
-        
-        # Return minimal info for sidebar
-        sidebar_sessions = [{
-            "id": s['id'],
-            "name": s['name'],
-            "created_at": s['created_at'],
-            "updated_at": s['updated_at'],
-            "message_count": len(s['messages'])
-        } for s in sessions_list]
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            sessions = sessions_data['sessions']
+            
+            # Return minimal info for sidebar, newest first
+            sidebar_sessions = [{
+                "id": s['id'],
+                "name": s['name'],
+                "created_at": s['created_at'],
+                "updated_at": s['updated_at'],
+                "message_count": len(s['messages'])
+            } for s in (sessions[sid] for sid in _sessions_cache["order"])]
+            active_session = sessions_data.get('active_session')
         
         return jsonify({
             "sessions": sidebar_sessions,
-            "active_session": sessions_data.get('active_session'),
+            "active_session": active_session,
             "count": len(sidebar_sessions)
         }), 200
     except Exception as e:
-        logger.error(f"Error retrieving sessions: {str(e)}")
+        logger.error("Error retrieving sessions: %s", e)
         return jsonify({"error": f"Failed to retrieve sessions: {str(e)}"}), 500
 
 @app.route('/chat/session/<session_id>', methods=['GET'])
 def get_session(session_id):
     """Endpoint to retrieve a specific chat session with all messages and load its vector store."""
     try:
-        sessions_data = load_chat_sessions()
-        if session_id not in sessions_data['sessions']:
-            return jsonify({"error": "Session not found"}), 404
-        
-        # Set as active session
-        sessions_data['active_session'] = session_id
-        save_chat_sessions(sessions_data)
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            if session_id not in sessions_data['sessions']:
+                return jsonify({"error": "Session not found"}), 404
+            
+            # Set as active session
+            sessions_data['active_session'] = session_id
+            save_chat_sessions(sessions_data)
+            
+            session = sessions_data['sessions'][session_id]
+            has_documents = bool(session.get('documents'))
+            response = jsonify({
+                "session": session
+            })
         
         # Load this session's vector store (if it has documents)
-        session = sessions_data['sessions'][session_id]
-        if session.get('documents') and len(session['documents']) > 0:
-            logger.info(f"Loading vector store for session {session_id}")
+        if has_documents:
+            logger.info("Loading vector store for session %s", session_id)
             load_session_vector_store(session_id)
         else:
-            logger.info(f"Session {session_id} has no documents")
+            logger.info("Session %s has no documents", session_id)
         
-        return jsonify({
-            "session": session
-        }), 200
+        return response, 200
     except Exception as e:
-        logger.error(f"Error retrieving session: {str(e)}")
+        logger.error("Error retrieving session: %s", e)
         return jsonify({"error": f"Failed to retrieve session: {str(e)}"}), 500
 
 @app.route('/chat/session/new', methods=['POST'])
@@ -719,12 +1328,13 @@ def new_session():
     """Endpoint to create a new chat session."""
     try:
         session_id = create_new_session()
-        sessions_data = load_chat_sessions()
-        return jsonify({
-            "session": sessions_data['sessions'][session_id]
-        }), 201
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            return jsonify({
+                "session": sessions_data['sessions'][session_id]
+            }), 201
     except Exception as e:
-        logger.error(f"Error creating session: {str(e)}")
+        logger.error("Error creating session: %s", e)
         return jsonify({"error": f"Failed to create session: {str(e)}"}), 500
 
 @app.route('/chat/session/<session_id>/rename', methods=['PUT'])
@@ -739,112 +1349,219 @@ def rename_session(session_id):
         if not new_name or len(new_name) > 100:
             return jsonify({"error": "Invalid name length"}), 400
         
-        sessions_data = load_chat_sessions()
-        if session_id not in sessions_data['sessions']:
-            return jsonify({"error": "Session not found"}), 404
-        
-        sessions_data['sessions'][session_id]['name'] = new_name
-        sessions_data['sessions'][session_id]['updated_at'] = datetime.now().isoformat()
-        save_chat_sessions(sessions_data)
-        
-        logger.info(f"Renamed session {session_id} to: {new_name}")
-        return jsonify({
-            "message": "Session renamed successfully",
-            "session": sessions_data['sessions'][session_id]
-        }), 200
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            if session_id not in sessions_data['sessions']:
+                return jsonify({"error": "Session not found"}), 404
+            
+            sessions_data['sessions'][session_id]['name'] = new_name
+            sessions_data['sessions'][session_id]['updated_at'] = datetime.now().isoformat()
+            _touch_session(session_id)
+            save_chat_sessions(sessions_data)
+            
+            logger.info("Renamed session %s to: %s", session_id, new_name)
+            return jsonify({
+                "message": "Session renamed successfully",
+                "session": sessions_data['sessions'][session_id]
+            }), 200
     except Exception as e:
-        logger.error(f"Error renaming session: {str(e)}")
+        logger.error("Error renaming session: %s", e)
         return jsonify({"error": f"Failed to rename session: {str(e)}"}), 500
 
 @app.route('/chat/session/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Endpoint to delete a chat session."""
     try:
-        sessions_data = load_chat_sessions()
-        if session_id not in sessions_data['sessions']:
-            return jsonify({"error": "Session not found"}), 404
-        
-        session_name = sessions_data['sessions'][session_id]['name']
-        del sessions_data['sessions'][session_id]
-        
-        # Clear active session if it was the deleted one
-        if sessions_data.get('active_session') == session_id:
-            sessions_data['active_session'] = None
-        
-        save_chat_sessions(sessions_data)
-        logger.info(f"Deleted session: {session_name}")
+        with _sessions_lock:
+            sessions_data = load_chat_sessions()
+            if session_id not in sessions_data['sessions']:
+                return jsonify({"error": "Session not found"}), 404
+            
+            session_name = sessions_data['sessions'][session_id]['name']
+            del sessions_data['sessions'][session_id]
+            _sessions_cache["order"].remove(session_id)
+            
+            # Clear active session if it was the deleted one
+            if sessions_data.get('active_session') == session_id:
+                sessions_data['active_session'] = None
+            
+            save_chat_sessions(sessions_data)
+        logger.info("Deleted session: %s", session_name)
         
         return jsonify({
             "message": f"Session '{session_name}' deleted successfully"
         }), 200
     except Exception as e:
-        logger.error(f"Error deleting session: {str(e)}")
+        logger.error("Error deleting session: %s", e)
         return jsonify({"error": f"Failed to delete session: {str(e)}"}), 500
 
+def _list_upload_files() -> List[str]:
+    """Names of the files in the uploads folder, using the type cached by scandir."""
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        return [entry.name for entry in entries if not entry.is_dir(follow_symlinks=False)]
+
+def _rm_upload_files(filenames: List[str]):
+    """Delete files from the uploads folder with as few `rm` processes as the argv limit allows."""
+    batch, batch_bytes = [], 0
+    for filename in filenames:
+        if batch and batch_bytes + len(filename) + 1 > RM_ARG_BYTES:
+            subprocess.run(['rm', '-f', '--', *batch], cwd=UPLOAD_FOLDER, check=False)
+            batch, batch_bytes = [], 0
+        batch.append(filename)
+        batch_bytes += len(filename) + 1
+    if batch:
+        subprocess.run(['rm', '-f', '--', *batch], cwd=UPLOAD_FOLDER, check=False)
+
+def _remove_upload_files(filenames: List[str]):
+    """
+    Delete the given files from the uploads folder while keeping the folder itself.
+    Large batches go through a few `rm` calls on POSIX, or are unlinked from a
+    thread pool elsewhere. Otherwise files are unlinked relative to an open
+    directory fd, where supported, to skip per-file path lookups.
+    """
+    if len(filenames) > RM_BATCH_THRESHOLD:
+        if os.name == 'posix' and shutil.which('rm'):
+            _rm_upload_files(filenames)
+        else:
+            paths = [os.path.join(UPLOAD_FOLDER, filename) for filename in filenames]
+            with ThreadPoolExecutor(max_workers=UNLINK_WORKERS) as executor:
+                list(executor.map(_unlink_missing_ok, paths))
+        return
+    
+    dir_fd = os.open(UPLOAD_FOLDER, os.O_RDONLY | os.O_DIRECTORY) if os.unlink in os.supports_dir_fd else None
+    try:
+        for filename in filenames:
+            if dir_fd is None:
+                _unlink_missing_ok(os.path.join(UPLOAD_FOLDER, filename))
+            else:
+                _unlink_missing_ok(filename, dir_fd)
+    finally:
+        if dir_fd is not None:
+            os.close(dir_fd)
+
+def _unlink_missing_ok(path: str, dir_fd: Optional[int] = None):
+    """Unlink a file, ignoring files that are already gone."""
+    try:
+        os.unlink(path, dir_fd=dir_fd)
+    except FileNotFoundError:
+        pass
+
+def _live_file_ids() -> List[str]:
+    """file_ids whose vectors must be kept: current documents plus in-flight uploads."""
+    with _meta_lock:
+        return list(set(get_state().document_metadata) | _indexing_file_ids)
+
+def _finalize_clear(filenames: List[str], vector_store: Chroma):
+    """Disk cleanup for /clear, run off the request path."""
+    try:
+        # Empty the collection in place so the store stays open for the next upload.
+        # Everything not in the state at the time this job runs goes, including
+        # vectors left by earlier runs and by failed uploads
+        with _indexing_lock:
+            keep = _live_file_ids()
+            if keep:
+                vector_store._collection.delete(where={"file_id": {"$nin": keep}})
+            else:
+                # Chroma rejects an empty $nin list
+                stale_ids = vector_store._collection.get(include=[])['ids']
+                for i in range(0, len(stale_ids), CHROMA_BATCH_SIZE):
+                    vector_store._collection.delete(ids=stale_ids[i:i + CHROMA_BATCH_SIZE])
+        logger.info("Vector store cleared, kept %s documents", len(keep))
+    except Exception as e:
+        logger.error("Error clearing vector store: %s", e)
+    try:
+        # Uploads still in flight when the clear started keep their files
+        with _indexing_lock:
+            live = set(_live_file_ids())
+        filenames = [filename for filename in filenames if filename.split('_', 1)[0] not in live]
+        _remove_upload_files(filenames)
+        logger.info("Removed %s uploaded files", len(filenames))
+    except Exception as e:
+        logger.error("Error removing uploaded files: %s", e)
+
+def _cleanup_worker():
+    """Run queued cleanup jobs one at a time, so clears never overlap on disk."""
+    while True:
+        fn, args = _cleanup_q.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error("Cleanup job failed: %s", e)
+        finally:
+            _cleanup_q.task_done()
+
+threading.Thread(target=_cleanup_worker, name="cleanup-worker", daemon=True).start()
+atexit.register(_cleanup_q.join)
+
 @app.route('/clear', methods=['POST'])
 def clear_database():
     """
     Endpoint to clear the vector database and reset the system.
     Useful for starting fresh with new documents.
     Can optionally preserve chat history.
+    In-memory state is reset immediately; vectors and uploaded files are deleted
+    in the background, so the endpoint responds with 202 Accepted.
     """
-    global vector_store, qa_chain, document_metadata, all_documents
-    
     try:
         data = request.get_json() or {}
         clear_history = data.get('clear_history', True)
         
-        # Reset global variables
-        vector_store = None
-        qa_chain = None
-        document_metadata = {}
-        all_documents = []
-        
-        # Clear uploaded files
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        
-        # Clear session state
-        save_session_state()
-        
-        # Optionally clear chat sessions
-        if clear_history:
-            save_chat_sessions({"sessions": {}, "active_session": None})
-            logger.info("Database and history cleared successfully")
-            message = "Database and chat history cleared successfully"
-        else:
-            logger.info("Database cleared (history preserved)")
-            message = "Database cleared successfully. Chat history preserved."
+        with _clear_lock:
+            # Reset the application state with a single swap, keeping the vector
+            # store open so it is emptied and reused rather than rebuilt
+            with _meta_lock:
+                vector_store = _documents_store(get_state())
+                app.extensions['state'] = AppState(vector_store=vector_store)
+                # Clear session state with a single WAL record
+                _log_session_op({"op": "reset"})
+            
+            # Snapshot the uploads now so files uploaded after this clear are kept
+            _cleanup_q.put((_finalize_clear, (_list_upload_files(), vector_store)))
+            
+            # Optionally clear chat sessions, snapshotting both state files in one write
+            if clear_history:
+                save_all_state({"sessions": {}, "active_session": None})
+                logger.info("Database and history cleared successfully")
+                message = "Database and chat history cleared successfully"
+            else:
+                logger.info("Database cleared (history preserved)")
+                message = "Database cleared successfully. Chat history preserved."
         
         return jsonify({
             "message": message
-        }), 200
+        }), 202
         
     except Exception as e:
-        logger.error(f"Error clearing database: {str(e)}")
+        logger.error("Error clearing database: %s", e)
         return jsonify({"error": f"Failed to clear database: {str(e)}"}), 500
 
 @app.route('/restore', methods=['POST'])
 def restore_previous_session():
     """
     Endpoint to manually restore previous session.
-    Reloads documents and vector store from saved state.
+    Restores document metadata immediately and loads the vector store in the
+    background; /chat answers 503 until it is ready.
     """
     try:
-        success = restore_session()
-        if success:
-            return jsonify({
-                "message": "Session restored successfully",
-                "documents": document_metadata
-            }), 200
+        # Skip the reload when nothing was saved since the last restore
+        state = get_state()
+        sig = _session_state_signature()
+        if sig == state.restore_sig and state.document_metadata and (state.qa_chain is not None or state.warming):
+            with _meta_lock:
+                return _documents_response("Session already current"), 200
+        
+        saved_documents = restore_metadata()
+        if saved_documents:
+            get_state().restore_sig = sig
+            threading.Thread(target=warm_index, args=(saved_documents,), name="warm-index", daemon=True).start()
+            with _meta_lock:
+                return _documents_response("Session restored successfully"), 200
         else:
             return jsonify({
                 "message": "No previous session found or session is empty"
             }), 404
     except Exception as e:
-        logger.error(f"Error restoring session: {str(e)}")
+        logger.error("Error restoring session: %s", e)
         return jsonify({"error": f"Failed to restore session: {str(e)}"}), 500
 
 if __name__ == '__main__':
@@ -852,5 +1569,11 @@ if __name__ == '__main__':
     logger.info("Starting DocuChat AI Backend...")
     logger.info("→ Starting with fresh session (documents will be cleared)")
     
-    # Run Flask app in development mode
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if os.getenv('FLASK_ENV') == 'development':
+        # Run the Flask development server without the reloader, which would
+        # import the app (and its models) a second time in a child process
+        app.run(debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False, host='0.0.0.0', port=5000)
+    else:
+        # Serve with waitress's multi-threaded production server
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5000, threads=int(os.getenv('THREADS', '8')))